@@ -3,6 +3,10 @@
 and real trajectory tags from Supabase."""
 
 import json, re, os, random
+from collections import Counter
+from functools import lru_cache
+
+from jsonl_io import write_jsonl
 
 random.seed(42)
 
@@ -51,6 +55,7 @@ question_templates = [
     "What's the move?",
 ]
 
+@lru_cache(maxsize=None)  # base data repeats the same short replies many times
 def compute_trajectory_tag(text):
     """Compute trajectory conditioning tag from text characteristics."""
     length = len(text)
@@ -143,7 +148,11 @@ random.shuffle(all_train)
 # Remove any AI-contaminated examples
 ai_phrases = ["great job", "hey there", "hey!", "let me help", "let's break down",
               "here's what", "i'd recommend", "happy to help", "let's tackle", "good question"]
-all_train = [ex for ex in all_train if not any(p in ex["messages"][2]["content"].lower() for p in ai_phrases)]
+def has_ai_phrase(text):
+    lower = text.lower()
+    return any(p in lower for p in ai_phrases)
+
+all_train = [ex for ex in all_train if not has_ai_phrase(ex["messages"][2]["content"])]
 
 # 9. Split: keep separate valid set
 all_valid = base_valid + stream_examples[:10]  # Add some stream to valid too
@@ -159,24 +168,24 @@ print(f"Train: {len(all_train)}")
 print(f"Valid: {len(all_valid)}")
 print(f"Avg response: {sum(lengths)/len(lengths):.0f} chars")
 print(f"Max response: {max(lengths)} chars")
-print(f"<50 chars: {sum(1 for l in lengths if l < 50)} ({sum(1 for l in lengths if l < 50)/len(lengths)*100:.1f}%)")
-print(f"50-200: {sum(1 for l in lengths if 50 <= l < 200)} ({sum(1 for l in lengths if 50 <= l < 200)/len(lengths)*100:.1f}%)")
-print(f"200-500: {sum(1 for l in lengths if 200 <= l < 500)} ({sum(1 for l in lengths if 200 <= l < 500)/len(lengths)*100:.1f}%)")
-print(f">500: {sum(1 for l in lengths if l >= 500)} ({sum(1 for l in lengths if l >= 500)/len(lengths)*100:.1f}%)")
-print(f">1000: {sum(1 for l in lengths if l >= 1000)} ({sum(1 for l in lengths if l >= 1000)/len(lengths)*100:.1f}%)")
+# One pass over lengths into disjoint buckets; >500 is 500-1000 plus >1000
+buckets = Counter("<50 chars" if l < 50 else "50-200" if l < 200 else "200-500" if l < 500
+                  else "500-1000" if l < 1000 else ">1000" for l in lengths)
+buckets[">500"] = buckets["500-1000"] + buckets[">1000"]
+for label in ["<50 chars", "50-200", "200-500", ">500", ">1000"]:
+    print(f"{label}: {buckets[label]} ({buckets[label]/len(lengths)*100:.1f}%)")
 
 # Trajectory tag distribution
-tags = {}
-for ex in all_train:
-    s = ex["messages"][0]["content"]
-    if "corrective" in s: tags["corrective"] = tags.get("corrective", 0) + 1
-    elif "directive" in s: tags["directive"] = tags.get("directive", 0) + 1
-    elif "ideating" in s: tags["ideating"] = tags.get("ideating", 0) + 1
-    elif "operational" in s: tags["operational"] = tags.get("operational", 0) + 1
-    else: tags["other"] = tags.get("other", 0) + 1
+def tag_phase(s):
+    for phase in ("corrective", "directive", "ideating", "operational"):
+        if phase in s:
+            return phase
+    return "other"
+
+tags = Counter(tag_phase(ex["messages"][0]["content"]) for ex in all_train)
 print()
 print("TRAJECTORY TAGS:")
-for k, v in sorted(tags.items(), key=lambda x: -x[1]):
+for k, v in tags.most_common():
     print(f"  {k}: {v} ({v/len(all_train)*100:.1f}%)")
 
 # Sample a stream-of-consciousness example
@@ -189,15 +198,10 @@ if long_samples:
     print(f"  User: {s['messages'][1]['content']}")
     print(f"  Mohamed ({len(s['messages'][2]['content'])} chars): {s['messages'][2]['content'][:300]}...")
 
-# 11. Write
-with open(os.path.join(OUTPUT_DIR, "train.jsonl"), "w") as f:
-    for ex in all_train:
-        f.write(json.dumps(ex) + "\n")
-with open(os.path.join(OUTPUT_DIR, "valid.jsonl"), "w") as f:
-    for ex in all_valid:
-        f.write(json.dumps(ex) + "\n")
-with open(os.path.join(OUTPUT_DIR, "test.jsonl"), "w") as f:
-    for ex in all_valid:
-        f.write(json.dumps(ex) + "\n")
+# 11. Write (valid is serialized once and reused for test)
+valid_data = [json.dumps(ex) + "\n" for ex in all_valid]
+write_jsonl(os.path.join(OUTPUT_DIR, "train.jsonl"), (json.dumps(ex) + "\n" for ex in all_train))
+write_jsonl(os.path.join(OUTPUT_DIR, "valid.jsonl"), valid_data)
+write_jsonl(os.path.join(OUTPUT_DIR, "test.jsonl"), valid_data)
 
 print(f"\nWritten to {OUTPUT_DIR}")
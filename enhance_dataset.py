@@ -14,6 +14,8 @@ import re
 from collections import Counter
 from pathlib import Path
 
+from jsonl_io import write_jsonl
+
 random.seed(42)
 
 INPUT_PATH = os.path.expanduser("~/projects/karl/autocontinue-data/train_merged.jsonl")
@@ -733,11 +735,23 @@ SYNTHETIC_PAIRS: list[tuple[str, str]] = [
 ]
 
 
+TRAILING_BRACKET_RE = re.compile(r"\]$")
+
+# Patterns that indicate non-useful training data
+FILTER_PATTERNS = [
+    re.compile(r"Full transcript available at:"),
+    re.compile(r"/private/tmp/claude"),
+    re.compile(r"\.output$"),
+    re.compile(r"/exit exit"),
+    re.compile(r"^\s*$"),
+]
+
+
 def normalize_response(text: str) -> str:
     """Lowercase, strip, remove trailing punctuation brackets, for map lookup."""
     t = text.strip().lower()
     # Strip trailing ] from "CONTINUE]" pattern
-    t = re.sub(r"\]$", "", t).strip()
+    t = TRAILING_BRACKET_RE.sub("", t).strip()
     return t
 
 
@@ -850,21 +864,12 @@ def main():
     # ------------------------------------------------------------------
     print("\n=== Filtering low-quality examples ===")
 
-    # Patterns that indicate non-useful training data
-    FILTER_PATTERNS = [
-        r"Full transcript available at:",
-        r"/private/tmp/claude",
-        r"\.output$",
-        r"/exit exit",
-        r"^\s*$",
-    ]
-
     def is_low_quality(text: str) -> bool:
-        for pat in FILTER_PATTERNS:
-            if re.search(pat, text):
-                return True
         if len(text.strip()) < 3:
             return True
+        for pat in FILTER_PATTERNS:
+            if pat.search(text):
+                return True
         return False
 
     pre_filter_count = len(existing_train)
@@ -949,13 +954,8 @@ def main():
     train_path = os.path.join(OUTPUT_DIR, "train.jsonl")
     valid_path = os.path.join(OUTPUT_DIR, "valid.jsonl")
 
-    with open(train_path, "w") as f:
-        for ex in train_set:
-            f.write(json.dumps(ex) + "\n")
-
-    with open(valid_path, "w") as f:
-        for ex in valid_set:
-            f.write(json.dumps(ex) + "\n")
+    write_jsonl(train_path, (json.dumps(ex) + "\n" for ex in train_set))
+    write_jsonl(valid_path, (json.dumps(ex) + "\n" for ex in valid_set))
 
     print(f"\n  Written: {train_path}")
     print(f"  Written: {valid_path}")
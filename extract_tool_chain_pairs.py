@@ -26,6 +26,8 @@ import sys
 from collections import Counter
 from pathlib import Path
 
+from jsonl_io import write_jsonl
+
 random.seed(42)
 
 # ── Paths ──────────────────────────────────────────────────────────────────────
@@ -62,6 +64,20 @@ SECRET_PATTERNS = [
     re.compile(r"password\s*[:=]\s*\S{8,}", re.IGNORECASE),
 ]
 
+# Broader catch-all redactions applied after SECRET_PATTERNS
+REDACT_PATTERNS = [
+    (re.compile(r"eyJ[a-zA-Z0-9_=-]{40,}"), "[REDACTED_JWT]"),
+    (re.compile(r"AIza[a-zA-Z0-9_-]{20,}"), "[REDACTED_GAPI]"),
+    (re.compile(r"sk-[a-zA-Z0-9_-]{20,}"), "[REDACTED_KEY]"),
+    (re.compile(r"ghp_[a-zA-Z0-9]{20,}"), "[REDACTED_GH]"),
+    (re.compile(r"AKIA[A-Z0-9]{12,}"), "[REDACTED_AWS]"),
+]
+
+# ── Text cleanup ───────────────────────────────────────────────────────────────
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+XML_TAG_RE = re.compile(r"<[^>]+>")
+WHITESPACE_RE = re.compile(r"\s+")
+
 # ── Skip patterns ──────────────────────────────────────────────────────────────
 SKIP_PATTERNS = [
     re.compile(r"^<task-notification>"),
@@ -178,16 +194,18 @@ def detect_project(text_blob: str) -> str:
     return ""
 
 
+# Hostname is fixed for the whole run, resolve it once instead of per example
+_HOSTNAME = socket.gethostname().lower()
+_HOST_MACHINE = "mac1" if ("mac1" in _HOSTNAME or "mohameddiomande" in _HOSTNAME) else ""
+
+
 def detect_machine(text_blob: str) -> str:
     """Detect machine from text."""
     for name, pat in MACHINE_PATTERNS.items():
         if pat.search(text_blob):
             return name
     # Default: detect from hostname
-    hostname = socket.gethostname().lower()
-    if "mac1" in hostname or "mohameddiomande" in hostname:
-        return "mac1"
-    return ""
+    return _HOST_MACHINE
 
 
 # ── Session parsing ────────────────────────────────────────────────────────────
@@ -204,7 +222,15 @@ def parse_session_v3(jsonl_path: str) -> list[dict]:
         "session_id": str,
     }
     """
-    entries = []
+    # Single streaming pass: raw entries (with full tool output) are never held
+    # in memory. Tool results show up in user entries after the assistant turn
+    # that issued the call, so calls are linked to their results at the end.
+    tool_results = {}
+    pending_calls = []
+    turns = []
+    seen_content = set()
+    state = {"cwd": ""}
+
     try:
         with open(jsonl_path) as f:
             for line in f:
@@ -212,156 +238,147 @@ def parse_session_v3(jsonl_path: str) -> list[dict]:
                 if not line:
                     continue
                 try:
-                    entries.append(json.loads(line))
+                    e = json.loads(line)
                 except json.JSONDecodeError:
                     continue
+
+                _consume_entry(e, turns, tool_results, pending_calls, seen_content, state)
     except (IOError, OSError):
         return []
 
-    # First pass: build tool_use_id -> result mapping
-    tool_results = {}
-    for e in entries:
-        if e.get("type") != "user":
-            continue
-        msg = e.get("message", {})
-        if not isinstance(msg, dict):
-            continue
-        content = msg.get("content", "")
-        if not isinstance(content, list):
-            continue
-        for block in content:
-            if isinstance(block, dict) and block.get("type") == "tool_result":
-                tool_use_id = block.get("tool_use_id", "")
-                if tool_use_id:
-                    tool_results[tool_use_id] = extract_tool_result_snippet(
-                        block.get("content", "")
-                    )
-
-    # Second pass: build conversation turns
-    turns = []
-    seen_content = set()
-    session_cwd = ""
-
-    for e in entries:
-        entry_type = e.get("type", "")
-        if entry_type not in ("user", "assistant"):
-            continue
+    for tc, tu_id in pending_calls:
+        if tu_id in tool_results:
+            tc["result_snippet"] = tool_results[tu_id]
 
-        cwd = e.get("cwd", "")
-        if cwd:
-            session_cwd = cwd
-        session_id = e.get("sessionId", "")
+    return turns
 
-        msg = e.get("message", {})
-        if not isinstance(msg, dict):
-            continue
 
-        content_raw = msg.get("content", "")
+def _consume_entry(e: dict, turns: list[dict], tool_results: dict, pending_calls: list,
+                   seen_content: set, state: dict) -> None:
+    """Fold one session entry into turns, collecting tool calls and results."""
+    entry_type = e.get("type", "")
+    if entry_type not in ("user", "assistant"):
+        return
 
-        if entry_type == "assistant":
-            # Extract text blocks and tool_use blocks
-            text_parts = []
-            tool_calls = []
-
-            if isinstance(content_raw, list):
-                for block in content_raw:
-                    if not isinstance(block, dict):
-                        continue
-                    if block.get("type") == "text":
-                        text_parts.append(block.get("text", ""))
-                    elif block.get("type") == "tool_use":
-                        tc = {
-                            "name": block.get("name", "unknown"),
-                            "input_snippet": _tool_input_snippet(block.get("input", {})),
-                        }
-                        # Look up result
-                        tu_id = block.get("id", "")
-                        if tu_id in tool_results:
-                            tc["result_snippet"] = tool_results[tu_id]
-                        tool_calls.append(tc)
-            elif isinstance(content_raw, str):
-                text_parts.append(content_raw)
+    cwd = e.get("cwd", "")
+    if cwd:
+        state["cwd"] = cwd
+    session_cwd = state["cwd"]
+    session_id = e.get("sessionId", "")
 
-            text = "\n".join(text_parts).strip()
+    msg = e.get("message", {})
+    if not isinstance(msg, dict):
+        return
 
-            # If this is a tool-only turn (no text), merge tool calls into previous
-            # assistant turn or create a minimal turn
-            if not text and tool_calls:
-                if turns and turns[-1]["role"] == "assistant":
-                    turns[-1]["tool_calls"].extend(tool_calls)
-                    continue
-                else:
-                    turns.append({
-                        "role": "assistant",
-                        "content": "",
-                        "tool_calls": tool_calls,
-                        "cwd": session_cwd,
-                        "session_id": session_id,
-                    })
-                    continue
+    content_raw = msg.get("content", "")
 
-            if not text:
-                # Also merge tool calls if present
-                if tool_calls and turns and turns[-1]["role"] == "assistant":
-                    turns[-1]["tool_calls"].extend(tool_calls)
-                continue
-
-            content_hash = hashlib.md5(text.encode()).hexdigest()
-            if content_hash in seen_content:
-                continue
-            seen_content.add(content_hash)
+    if entry_type == "assistant":
+        # Extract text blocks and tool_use blocks
+        text_parts = []
+        tool_calls = []
 
+        if isinstance(content_raw, list):
+            for block in content_raw:
+                if not isinstance(block, dict):
+                    continue
+                if block.get("type") == "text":
+                    text_parts.append(block.get("text", ""))
+                elif block.get("type") == "tool_use":
+                    tc = {
+                        "name": block.get("name", "unknown"),
+                        "input_snippet": _tool_input_snippet(block.get("input", {})),
+                    }
+                    # Result arrives in a later entry, link it after the pass
+                    pending_calls.append((tc, block.get("id", "")))
+                    tool_calls.append(tc)
+        elif isinstance(content_raw, str):
+            text_parts.append(content_raw)
+
+        text = "\n".join(text_parts).strip()
+
+        # If this is a tool-only turn (no text), merge tool calls into previous
+        # assistant turn or create a minimal turn
+        if not text and tool_calls:
             if turns and turns[-1]["role"] == "assistant":
-                turns[-1]["content"] += "\n\n" + text
                 turns[-1]["tool_calls"].extend(tool_calls)
+                return
             else:
                 turns.append({
                     "role": "assistant",
-                    "content": text,
+                    "content": "",
                     "tool_calls": tool_calls,
                     "cwd": session_cwd,
                     "session_id": session_id,
                 })
+                return
 
-        elif entry_type == "user":
-            # Skip tool_result-only user messages
-            if isinstance(content_raw, list):
-                has_text = False
-                text_parts = []
-                for block in content_raw:
-                    if isinstance(block, dict) and block.get("type") == "text":
-                        t = block.get("text", "").strip()
-                        if t:
-                            text_parts.append(t)
-                            has_text = True
-                if not has_text:
-                    continue
-                text = "\n".join(text_parts).strip()
-            elif isinstance(content_raw, str):
-                text = content_raw.strip()
-            else:
-                continue
+        if not text:
+            # Also merge tool calls if present
+            if tool_calls and turns and turns[-1]["role"] == "assistant":
+                turns[-1]["tool_calls"].extend(tool_calls)
+            return
 
-            if not text:
-                continue
+        content_hash = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        if content_hash in seen_content:
+            return
+        seen_content.add(content_hash)
 
-            content_hash = hashlib.md5(text.encode()).hexdigest()
-            if content_hash in seen_content:
-                continue
-            seen_content.add(content_hash)
+        if turns and turns[-1]["role"] == "assistant":
+            turns[-1]["content"] += "\n\n" + text
+            turns[-1]["tool_calls"].extend(tool_calls)
+        else:
+            turns.append({
+                "role": "assistant",
+                "content": text,
+                "tool_calls": tool_calls,
+                "cwd": session_cwd,
+                "session_id": session_id,
+            })
+
+    elif entry_type == "user":
+        # Skip tool_result-only user messages
+        if isinstance(content_raw, list):
+            for block in content_raw:
+                if isinstance(block, dict) and block.get("type") == "tool_result":
+                    tool_use_id = block.get("tool_use_id", "")
+                    if tool_use_id:
+                        tool_results[tool_use_id] = extract_tool_result_snippet(
+                            block.get("content", "")
+                        )
+            has_text = False
+            text_parts = []
+            for block in content_raw:
+                if isinstance(block, dict) and block.get("type") == "text":
+                    t = block.get("text", "").strip()
+                    if t:
+                        text_parts.append(t)
+                        has_text = True
+            if not has_text:
+                return
+            text = "\n".join(text_parts).strip()
+        elif isinstance(content_raw, str):
+            text = content_raw.strip()
+        else:
+            return
 
-            if turns and turns[-1]["role"] == "user":
-                turns[-1]["content"] += "\n\n" + text
-            else:
-                turns.append({
-                    "role": "user",
-                    "content": text,
-                    "tool_calls": [],
-                    "cwd": session_cwd,
-                    "session_id": session_id,
-                })
+        if not text:
+            return
 
-    return turns
+        content_hash = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        if content_hash in seen_content:
+            return
+        seen_content.add(content_hash)
+
+        if turns and turns[-1]["role"] == "user":
+            turns[-1]["content"] += "\n\n" + text
+        else:
+            turns.append({
+                "role": "user",
+                "content": text,
+                "tool_calls": [],
+                "cwd": session_cwd,
+                "session_id": session_id,
+            })
 
 
 def _tool_input_snippet(inp: dict) -> str:
@@ -408,27 +425,41 @@ def _tool_input_snippet(inp: dict) -> str:
 
 # ── Context extraction ─────────────────────────────────────────────────────────
 
+def _fit_paragraph(para: str, max_len: int) -> str:
+    """Trim a paragraph to its trailing sentences that fit in max_len."""
+    if len(para) <= max_len:
+        return para
+    sentences = SENTENCE_SPLIT_RE.split(para)
+    result = ""
+    for s in reversed(sentences):
+        if len(result) + len(s) + 2 > max_len:
+            break
+        result = s + " " + result if result else s
+    return result.strip()
+
+
 def extract_assistant_question(text: str, max_len: int = 500) -> str:
     """Extract the last meaningful chunk from assistant text (the question/proposal)."""
     text = text.rstrip()
     if not text:
         return ""
 
-    paragraphs = text.split("\n\n")
-
-    # Find last non-empty paragraph
-    for para in reversed(paragraphs):
-        para = para.strip()
+    # Find last non-empty paragraph: probe the last few with rfind so long
+    # messages are not split whole, then split whatever is left in one go
+    end = len(text)
+    for _ in range(4):
+        if end <= 0:
+            break
+        start = text.rfind("\n\n", 0, end)
+        para = text[start + 2 if start >= 0 else 0:end].strip()
+        end = start
         if para and len(para) > 10:
-            if len(para) > max_len:
-                sentences = re.split(r"(?<=[.!?])\s+", para)
-                result = ""
-                for s in reversed(sentences):
-                    if len(result) + len(s) + 2 > max_len:
-                        break
-                    result = s + " " + result if result else s
-                return result.strip()
-            return para
+            return _fit_paragraph(para, max_len)
+    if end > 0:
+        for para in reversed(text[:end].split("\n\n")):
+            para = para.strip()
+            if para and len(para) > 10:
+                return _fit_paragraph(para, max_len)
 
     lines = text.split("\n")
     for line in reversed(lines):
@@ -477,11 +508,8 @@ def redact_secrets(text: str) -> str:
     for pat in SECRET_PATTERNS:
         text = pat.sub("[REDACTED]", text)
     # Also catch common patterns: anon keys, service role keys, etc
-    text = re.sub(r"eyJ[a-zA-Z0-9_=-]{40,}", "[REDACTED_JWT]", text)
-    text = re.sub(r"AIza[a-zA-Z0-9_-]{20,}", "[REDACTED_GAPI]", text)
-    text = re.sub(r"sk-[a-zA-Z0-9_-]{20,}", "[REDACTED_KEY]", text)
-    text = re.sub(r"ghp_[a-zA-Z0-9]{20,}", "[REDACTED_GH]", text)
-    text = re.sub(r"AKIA[A-Z0-9]{12,}", "[REDACTED_AWS]", text)
+    for pat, repl in REDACT_PATTERNS:
+        text = pat.sub(repl, text)
     return text
 
 
@@ -496,22 +524,22 @@ def build_system_prompt(
         "the context of what just happened."
     )
 
+    # Collect preformatted fragments and join once at the end
     parts = [base]
 
     if tool_chain_str:
         # Redact any secrets that may have leaked into tool output
-        tool_chain_str = redact_secrets(tool_chain_str)
-        parts.append(f"\nRecent tool calls:\n{tool_chain_str}")
+        parts += ("\n\nRecent tool calls:\n", redact_secrets(tool_chain_str))
 
-    meta = []
+    # Metadata block is separated by a blank line, its lines by a newline
+    sep = "\n\n"
     if project:
-        meta.append(f"Active project: {project}")
+        parts += (sep, "Active project: ", project)
+        sep = "\n"
     if machine:
-        meta.append(f"Machine: {machine}")
-    if meta:
-        parts.append("\n" + "\n".join(meta))
+        parts += (sep, "Machine: ", machine)
 
-    return "\n".join(parts)
+    return "".join(parts)
 
 
 # ── Filtering ──────────────────────────────────────────────────────────────────
@@ -523,12 +551,7 @@ def is_valid_response(text: str) -> bool:
         return False
     if len(text) > MAX_RESPONSE_LEN:
         return False
-    for pat in SKIP_PATTERNS:
-        if pat.search(text):
-            return False
-    for pat in BAD_RESPONSE_PATTERNS:
-        if pat.search(text):
-            return False
+    # Cheap string checks first so obvious rejects never reach the regex scans
     # Skip if just a URL
     if text.startswith("http") and "\n" not in text:
         return False
@@ -538,6 +561,12 @@ def is_valid_response(text: str) -> bool:
     # Skip em-dash-heavy content (likely AI-generated, not Mohamed)
     if text.count("—") > 2:
         return False
+    for pat in SKIP_PATTERNS:
+        if pat.search(text):
+            return False
+    for pat in BAD_RESPONSE_PATTERNS:
+        if pat.search(text):
+            return False
     # Skip responses containing secrets/credentials
     for pat in SECRET_PATTERNS:
         if pat.search(text):
@@ -575,9 +604,9 @@ def classify_response(answer: str) -> str:
 def clean_response(text: str) -> str:
     """Clean Mohamed's response text."""
     # Remove XML tags
-    text = re.sub(r"<[^>]+>", "", text).strip()
+    text = XML_TAG_RE.sub("", text).strip()
     # Normalize whitespace
-    text = re.sub(r"\s+", " ", text).strip()
+    text = WHITESPACE_RE.sub(" ", text).strip()
     # Apply Mohamed's style: no em dashes
     text = text.replace(" — ", ", ").replace("—", ", ")
     return text
@@ -962,6 +991,9 @@ def upgrade_v2_with_synthetic_chains(v2_examples: list[dict]) -> list[dict]:
         "ssh": "- Bash: ssh cloud-vm 'systemctl status' -> active",
     }
 
+    # Only a few (chain template, project) combinations exist, build each once
+    prompt_cache = {}
+
     for ex in v2_examples:
         # Apply same quality filters to v2 data
         answer = ex["assistant"].strip()
@@ -982,7 +1014,10 @@ def upgrade_v2_with_synthetic_chains(v2_examples: list[dict]) -> list[dict]:
         # Detect project from content
         project = detect_project(combined)
 
-        system_prompt = build_system_prompt(chain, project, "mac1")
+        system_prompt = prompt_cache.get((chain, project))
+        if system_prompt is None:
+            system_prompt = build_system_prompt(chain, project, "mac1")
+            prompt_cache[(chain, project)] = system_prompt
 
         # Redact secrets from user content too
         user_content = redact_secrets(ex["user"])
@@ -1073,20 +1108,19 @@ def main():
     valid = all_examples[split_idx:]
 
     # 8. Write output
-    def write_jsonl(examples: list[dict], path: str):
-        with open(path, "w") as f:
-            for ex in examples:
-                # Write only the messages (strip metadata for training)
-                record = {"messages": ex["messages"]}
-                f.write(json.dumps(record) + "\n")
+    def to_jsonl(examples: list[dict]):
+        # Write only the messages (strip metadata for training)
+        return (json.dumps({"messages": ex["messages"]}) + "\n" for ex in examples)
 
     train_path = os.path.join(OUTPUT_DIR, "train.jsonl")
     valid_path = os.path.join(OUTPUT_DIR, "valid.jsonl")
     test_path = os.path.join(OUTPUT_DIR, "test.jsonl")
 
-    write_jsonl(train, train_path)
-    write_jsonl(valid, valid_path)
-    write_jsonl(valid, test_path)  # test = copy of valid
+    # Serialize valid once, test is a byte-identical copy
+    valid_data = list(to_jsonl(valid))
+    write_jsonl(train_path, to_jsonl(train))
+    write_jsonl(valid_path, valid_data)
+    write_jsonl(test_path, valid_data)  # test = copy of valid
 
     # 9. Stats
     print("\n" + "=" * 60)
@@ -3,6 +3,36 @@
 
 import json, re, sys
 
+SENTENCE_END_RE = re.compile(r'[.!?]+')
+
+CONVERSATIONAL_MARKERS = (
+    'i think',
+    'we should',
+    'we need',
+    "let's",
+    'perhaps',
+    'what if',
+    'as you know',
+    'in fact',
+    'in any case',
+    'keep in mind',
+    'considering',
+    'the idea',
+    'imagine',
+    'given that',
+    'i want',
+    'i need',
+    'remember',
+    'also',
+    'as well',
+    'the fact that',
+    'to be honest',
+    'i was thinking',
+    'figure out',
+    'how would',
+    'definitely',
+)
+
 data = json.load(sys.stdin)
 if not isinstance(data, list):
     print(data); sys.exit()
@@ -24,35 +54,10 @@ for d in data:
     if 'Traceback' in t[:100]: continue
     if 'Uncaught' in t[:100]: continue
 
-    conversational = sum([
-        'i think' in t.lower(),
-        'we should' in t.lower(),
-        'we need' in t.lower(),
-        "let's" in t.lower(),
-        'perhaps' in t.lower(),
-        'what if' in t.lower(),
-        'as you know' in t.lower(),
-        'in fact' in t.lower(),
-        'in any case' in t.lower(),
-        'keep in mind' in t.lower(),
-        'considering' in t.lower(),
-        'the idea' in t.lower(),
-        'imagine' in t.lower(),
-        'given that' in t.lower(),
-        'i want' in t.lower(),
-        'i need' in t.lower(),
-        'remember' in t.lower(),
-        'also' in t.lower(),
-        'as well' in t.lower(),
-        'the fact that' in t.lower(),
-        'to be honest' in t.lower(),
-        'i was thinking' in t.lower(),
-        'figure out' in t.lower(),
-        'how would' in t.lower(),
-        'definitely' in t.lower(),
-    ])
+    lower = t.lower()
+    conversational = sum(m in lower for m in CONVERSATIONAL_MARKERS)
 
-    sentence_count = len(re.split(r'[.!?]+', t))
+    sentence_count = len(SENTENCE_END_RE.split(t))
 
     if conversational >= 2 or (sentence_count >= 3 and len(t) > 200):
         stream_msgs.append({
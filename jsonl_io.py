@@ -0,0 +1,16 @@
+"""Shared JSONL output helper for the dataset build scripts."""
+
+import os
+
+
+def write_jsonl(path: str, lines) -> None:
+    """Write JSONL lines via a temp file so a failed run keeps the old split."""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.writelines(lines)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)